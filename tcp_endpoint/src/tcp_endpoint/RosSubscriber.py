@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 
+import re
 import rospy
 import socket
 
 from tcp_endpoint.RosCommunication import RosReceiver
 from tcp_endpoint.RosTCPClientThread import ClientThread
 
+try:
+    from rospy.numpy_msg import numpy_msg
+except ImportError:
+    numpy_msg = None
+
+# Numeric array fields are otherwise deserialized into tuples of Python numbers only to be
+# packed straight back into bytes. uint8[] fields are already kept as raw bytes.
+NUMERIC_ARRAY_TYPE = re.compile(r'^(int(8|16|32|64)|uint(16|32|64)|float(32|64))\[\d*\]$')
+
 
 class RosSubscriber(RosReceiver):
     """
@@ -21,17 +31,21 @@ class RosSubscriber(RosReceiver):
             queue_size:    Max number of entries to maintain in an outgoing queue
         """
         self.topic = topic
+        # The topic never changes, so serialize it once rather than for every message sent
+        self.dest_header = ClientThread.serialize_destination(topic)
         self.node_name = "{}_subsciber".format(topic)
         self.msg = message_class
         self.tcp_server = tcp_server
         self.queue_size = queue_size
+        # Bound once since send runs at topic rate, skipping TCPServer's pass-through on every message
+        self.send_unity_message = tcp_server.unity_tcp_sender.send_unity_message
 
         # Start Subscriber listener function
         self.listener()
 
     def send(self, data):
         """
-        Connect to TCP endpoint on client and pass along message
+        Queue the message to be serialized and sent to Unity by the TCP sender thread
         Args:
             data: message data to send outside of ROS network
 
@@ -40,7 +54,7 @@ class RosSubscriber(RosReceiver):
 
         """
 
-        self.tcp_server.send_unity_message(self.topic, data)
+        self.send_unity_message(self.topic, data, self.dest_header, self.queue_size)
         return self.msg
 
     def listener(self):
@@ -49,4 +63,9 @@ class RosSubscriber(RosReceiver):
         Returns:
 
         """
-        rospy.Subscriber(self.topic, self.msg, self.send)
+        subscribe_class = self.msg
+        # Let numpy_msg keep numeric arrays as numpy buffers, which are written out in one go
+        if numpy_msg is not None and any(NUMERIC_ARRAY_TYPE.match(t) for t in self.msg._slot_types):
+            subscribe_class = numpy_msg(self.msg)
+
+        rospy.Subscriber(self.topic, subscribe_class, self.send)
@@ -9,6 +9,13 @@ from threading import Thread
 
 from tcp_endpoint.TCPEndpointExceptions import TopicOrServiceNameDoesNotExistError
 
+# Compiled once so the per-message length fields don't re-parse the format string
+_UINT32 = struct.Struct('<I')
+
+# Asks the kernel to fill the whole receive buffer before returning, where supported
+_RECV_FLAGS = getattr(socket, 'MSG_WAITALL', 0)
+
+
 class ClientThread(Thread):
     """
     Thread class to read all data from a connection and pass along the data to the
@@ -22,10 +29,43 @@ class ClientThread(Thread):
             source_destination_dict: dictionary of destination name to RosCommunicator class
         """
         Thread.__init__(self)
+        # Reads and writes loop until the whole message is through, make sure a default socket
+        # timeout can't cut one off halfway
+        conn.setblocking(True)
+        # Service responses are written as soon as they're ready, don't let Nagle hold them back
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.conn = conn
         self.tcp_server = tcp_server
         self.incoming_ip = incoming_ip
         self.incoming_port = incoming_port
+        # Reused for the message headers so they can be parsed in place
+        self._rbuf = bytearray(tcp_server.buffer_size)
+
+    def _recv_at_least(self, n, filled=0, limit=None):
+        """
+        Reads from socket connection into the read buffer until it holds at least n bytes.
+        Each read takes whatever has already arrived, up to limit or the size of the buffer,
+        so more than n bytes may end up in it. The read buffer is grown if it is too small.
+
+        Args:
+            n:      number of bytes needed at the start of the read buffer
+            filled: number of bytes already in the read buffer
+            limit:  most bytes to hold in the read buffer, pass n to read exactly n bytes
+
+        Returns: number of bytes now in the read buffer, None if the connection closed first
+
+        """
+        if len(self._rbuf) < n:
+            self._rbuf.extend(bytearray(n - len(self._rbuf)))
+
+        view = memoryview(self._rbuf)
+        while filled < n:
+            received = self.conn.recv_into(view[filled:limit])
+            if not received:
+                return None
+            filled += received
+
+        return filled
 
     def read_int32(self):
         """
@@ -35,9 +75,9 @@ class ClientThread(Thread):
 
         """
         try:
-            raw_bytes = self.conn.recv(4)
-            num = struct.unpack('<I', raw_bytes)[0]
-            return num
+            if self._recv_at_least(4, limit=4) is not None:
+                return _UINT32.unpack_from(self._rbuf, 0)[0]
+            print("Unable to read integer from connection. Connection closed.")
         except Exception as e:
             print("Unable to read integer from connection. {}".format(e))
 
@@ -54,17 +94,35 @@ class ClientThread(Thread):
         """
         try:
             str_len = self.read_int32()
+            if str_len is None:
+                return None
 
-            str_bytes = self.conn.recv(str_len)
-            decoded_str = str_bytes.decode('utf-8')
-
-            return decoded_str
+            # A single recv may return fewer than str_len bytes, so read until the string is complete
+            if self._recv_at_least(str_len, limit=str_len) is not None:
+                return self._rbuf[:str_len].decode('utf-8')
+            print("Unable to read string from connection. Connection closed.")
 
         except Exception as e:
             print("Unable to read string from connection. {}".format(e))
 
         return None
 
+    @staticmethod
+    def serialize_destination(destination):
+        """
+        Serialize a destination name into the length prefixed form that starts every message.
+        Senders that always use the same destination can serialize it once and reuse it with
+        serialize_message_cached.
+
+        Args:
+            destination: name of destination
+
+        Returns:
+            serialized destination as bytes
+        """
+        dest_bytes = destination.encode('utf-8')
+        return _UINT32.pack(len(dest_bytes)) + dest_bytes
+
     @staticmethod
     def serialize_message(destination, message):
         """
@@ -75,26 +133,64 @@ class ClientThread(Thread):
             message:     message class to serialize
 
         Returns:
-            serialized destination and message as a list of bytes
+            serialized message as a (header, body) tuple of buffers, where the header holds
+            the destination and message length and the body is a view of the serialized message
         """
-        dest_bytes = destination.encode('utf-8')
-        length = len(dest_bytes)
-        dest_info = struct.pack('<I%ss' % length, length, dest_bytes)
+        return ClientThread.serialize_message_cached(ClientThread.serialize_destination(destination), message)
 
+    @staticmethod
+    def serialize_message_cached(dest_header, message):
+        """
+        Serialize a message class behind an already serialized destination.
+
+        Args:
+            dest_header: destination as returned by serialize_destination
+            message:     message class to serialize
+
+        Returns:
+            serialized message as a (header, body) tuple of buffers, like serialize_message
+        """
         serial_response = BytesIO()
         message.serialize(serial_response)
 
-        # Per documention, https://docs.python.org/3.8/library/io.html#io.IOBase.seek,
-        # seek to end of stream for length
-        # SEEK_SET or 0 - start of the stream (the default); offset should be zero or positive
-        # SEEK_CUR or 1 - current stream position; offset may be negative
-        # SEEK_END or 2 - end of the stream; offset is usually negative
-        response_len = serial_response.seek(0, 2)
+        # serialize() only appends to the stream, so the current position is already its length
+        response_len = serial_response.tell()
+
+        # The header is the destination followed by the message length
+        dest_len = len(dest_header)
+        header = bytearray(dest_len + 4)
+        header[:dest_len] = dest_header
+        _UINT32.pack_into(header, dest_len, response_len)
+
+        # Send the body straight from the BytesIO buffer. getbuffer is Python 3 only.
+        if hasattr(serial_response, 'getbuffer'):
+            return header, serial_response.getbuffer()
+        return header, serial_response.getvalue()
+
+    @staticmethod
+    def send_serialized_message(conn, serialized_message):
+        """
+        Send all buffers of a serialized message, gathered into a single sendmsg call
+        where the platform supports it.
 
-        msg_length = struct.pack('<I', response_len)
-        serialized_message = dest_info + msg_length + serial_response.getvalue()
+        Args:
+            conn:               socket connection to send the message over
+            serialized_message: buffers to send, as returned by serialize_message
+        """
+        if not hasattr(conn, 'sendmsg'):
+            for buffer in serialized_message:
+                conn.sendall(buffer)
+            return
 
-        return serialized_message
+        buffers = [memoryview(buffer) for buffer in serialized_message if len(buffer)]
+        while buffers:
+            sent = conn.sendmsg(buffers)
+            # sendmsg may only write part of the buffers, drop whatever went out and send the rest
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if sent:
+                buffers[0] = buffers[0][sent:]
 
     def run(self):
         """
@@ -113,53 +209,80 @@ class ClientThread(Thread):
             msg: the ROS msg type as bytes
 
         """
-        data = b''
-
-        destination = self.read_string()
-        full_message_size = self.read_int32()
-
-        while len(data) < full_message_size:
-            # Only grabs max of 1024 bytes TODO: change to TCPServer's buffer_size
-            grab = 1024 if full_message_size - len(data) > 1024 else full_message_size - len(data)
-            packet = self.conn.recv(grab)
-
-            if not packet:
-                print("No packets...")
-                break
-
-            data += packet
-
-        if not data:
-            print("No data for a message size of {}, breaking!".format(full_message_size))
-            return
-
-        if destination.startswith('__'):
-            if destination not in self.tcp_server.special_destination_dict.keys():
-                error_msg = "System message '{}' is undefined! Known system calls are: {}"\
-                    .format(destination, self.tcp_server.special_destination_dict.keys())
-                self.conn.close()
-                self.tcp_server.send_unity_error(error_msg)
-                raise TopicOrServiceNameDoesNotExistError(error_msg)
-            else:
-                ros_communicator = self.tcp_server.special_destination_dict[destination]
-                ros_communicator.set_incoming_ip(self.incoming_ip)
-        elif destination not in self.tcp_server.source_destination_dict.keys():
-            error_msg = "Topic/service destination '{}' is not defined! Known topics are: {} "\
-                .format(destination, self.tcp_server.source_destination_dict.keys())
-            self.conn.close()
-            self.tcp_server.send_unity_error(error_msg)
-            raise TopicOrServiceNameDoesNotExistError(error_msg)
-        else:
-            ros_communicator = self.tcp_server.source_destination_dict[destination]
-
         try:
-            response = ros_communicator.send(data)
-
-            # Responses only exist for services
-            if response:
-                response_message = self.serialize_message(destination, response)
-                self.conn.send(response_message)
-        except Exception as e:
-            print("Exception Raised: {}".format(e))
+            tcp_server = self.tcp_server
+
+            # The first read takes whatever has arrived, which for most messages is the whole header
+            # and some or all of the payload, so reading the header rarely needs more than one call
+            filled = self._recv_at_least(4)
+            if filled is None:
+                print("Unable to read destination length from connection.")
+                return
+            dest_len = _UINT32.unpack_from(self._rbuf, 0)[0]
+            header_len = dest_len + 8
+
+            filled = self._recv_at_least(header_len, filled)
+            if filled is None:
+                print("Unable to read destination from connection.")
+                return
+            destination = self._rbuf[4:4 + dest_len].decode('utf-8')
+            full_message_size = _UINT32.unpack_from(self._rbuf, 4 + dest_len)[0]
+
+            # Read the payload straight into a buffer of the full message size
+            data = bytearray(full_message_size)
+            view = memoryview(data)
+
+            # Start with the part of the payload that came in with the header
+            received = min(filled - header_len, full_message_size)
+            view[:received] = memoryview(self._rbuf)[header_len:header_len + received]
+
+            # Ask for everything that's left, this only loops if interrupted or the connection closes
+            while received < full_message_size:
+                packet_size = self.conn.recv_into(view[received:], full_message_size - received, _RECV_FLAGS)
+
+                if not packet_size:
+                    print("No packets...")
+                    break
+
+                received += packet_size
+
+            if not data:
+                print("No data for a message size of {}, breaking!".format(full_message_size))
+                return
+
+            if received < full_message_size:
+                print("Only received {} of {} bytes, breaking!".format(received, full_message_size))
+                return
+
+            # Message deserializers expect an immutable bytes object
+            data = bytes(data)
+
+            if destination.startswith('__'):
+                ros_communicator = tcp_server.special_destination_dict.get(destination)
+                if ros_communicator is None:
+                    error_msg = "System message '{}' is undefined! Known system calls are: {}"\
+                        .format(destination, tcp_server.special_destination_dict.keys())
+                    tcp_server.send_unity_error(error_msg)
+                    raise TopicOrServiceNameDoesNotExistError(error_msg)
+                ros_communicator.set_incoming_ip(self.incoming_ip)
+            else:
+                ros_communicator = tcp_server.source_destination_dict.get(destination)
+                if ros_communicator is None:
+                    error_msg = "Topic/service destination '{}' is not defined!".format(destination)
+                    # Known topics are only formatted by the logger, at most once a minute
+                    rospy.logwarn_throttle(60, "Known topics are: %s", tcp_server.source_destination_dict.keys())
+                    tcp_server.send_unity_error(error_msg)
+                    raise TopicOrServiceNameDoesNotExistError(error_msg)
+
+            try:
+                response = ros_communicator.send(data)
+
+                # Responses only exist for services
+                if response:
+                    response_message = self.serialize_message(destination, response)
+                    self.send_serialized_message(self.conn, response_message)
+            except Exception as e:
+                print("Exception Raised: {}".format(e))
         finally:
+            # Also reached on every early return, so Unity always sees the connection end
             self.conn.close()
@@ -48,21 +48,16 @@ class TCPServer:
         tcp_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         tcp_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         tcp_server.bind((self.tcp_ip, self.tcp_port))
-        threads = []
+        tcp_server.listen(self.connections)
 
         while True:
-            tcp_server.listen(self.connections)
-
             (conn, (ip, port)) = tcp_server.accept()
+            # Client threads handle a single message and are not kept once started
             new_thread = ClientThread(conn, self, ip, port)
             new_thread.start()
-            threads.append(new_thread)
-
-        for t in threads:
-            t.join()
 
     def send_unity_error(self, error):
         self.unity_tcp_sender.send_unity_error(error)
 
-    def send_unity_message(self, topic, message):
-        self.unity_tcp_sender.send_unity_message(topic, message)
+    def send_unity_message(self, topic, message, dest_header=None, queue_size=None):
+        self.unity_tcp_sender.send_unity_message(topic, message, dest_header, queue_size)
@@ -1,8 +1,24 @@
 import rospy
 import socket
+import threading
+import time
+from collections import deque
 from tcp_endpoint.RosTCPClientThread import ClientThread
 from tcp_endpoint.msg import RosUnityError
 
+# After failing to reach Unity, the sender waits for a backoff period that doubles on each
+# consecutive failure before connecting again. Messages stay queued in the meantime.
+RECONNECT_BACKOFF_MIN = 0.05
+RECONNECT_BACKOFF_MAX = 1.0
+
+# time.monotonic is Python 3 only, fall back to wall clock time on Python 2
+_clock = getattr(time, 'monotonic', time.time)
+
+# Module level references, these are looked up for every message sent
+_serialize_destination = ClientThread.serialize_destination
+_serialize_message_cached = ClientThread.serialize_message_cached
+_send_serialized_message = ClientThread.send_serialized_message
+
 class UnityTCPSender:
     """
     Connects and sends messages to the server on the Unity side.
@@ -12,29 +28,99 @@ class UnityTCPSender:
         self.unity_port = unity_port
         # if we have a valid IP at this point, it was overridden locally so always use that
         self.ip_is_overridden = (self.unity_ip != '')
+        self.reconnect_backoff = RECONNECT_BACKOFF_MIN
+        self.next_connect_time = 0
+
+        # Messages from all subscribers are serialized and sent from a single background thread,
+        # so subscriber callbacks don't wait on Unity. Each destination has its own queue.
+        self.pending_messages = {}
+        self.pending_condition = threading.Condition()
+        self.sender_thread = threading.Thread(target=self.sender_loop)
+        self.sender_thread.daemon = True
+        self.sender_thread.start()
 
     def process_handshake(self, ip, port):
         self.unity_port = port
         if ip != '' and not self.ip_is_overridden:
             self.unity_ip = ip # hello Unity, we'll talk to you from now on
+        # Unity is evidently up, so don't hold back the next message because of earlier failures
+        self.reconnect_backoff = RECONNECT_BACKOFF_MIN
+        self.next_connect_time = 0
         print("ROS-Unity Handshake received, will connect to {}:{}".format(self.unity_ip, self.unity_port))
 
     def send_unity_error(self, error):
         self.send_unity_message("__error", RosUnityError(error))
 
-    def send_unity_message(self, topic, message):
+    def send_unity_message(self, topic, message, dest_header=None, queue_size=None):
+        """
+        Queue a message to be serialized and sent to Unity by the sender thread.
+
+        Args:
+            topic:       destination of the message on the Unity side
+            message:     message class to send
+            dest_header: topic as returned by ClientThread.serialize_destination, if already known
+            queue_size:  max number of this topic's messages to hold, the oldest are dropped
+                         beyond it. None never drops any.
+        """
         if self.unity_ip == '':
             print("Can't send a message, no defined unity IP!".format(topic, message))
             return
 
-        serialized_message = ClientThread.serialize_message(topic, message)
+        # Senders with a fixed topic pass in its serialized form so it isn't re-encoded every message
+        if dest_header is None:
+            dest_header = _serialize_destination(topic)
 
+        # Serializing is left to the sender thread as well, the caller only has to queue the message
+        pending_condition = self.pending_condition
+        with pending_condition:
+            queue = self.pending_messages.get(dest_header)
+            if queue is None:
+                queue = deque(maxlen=queue_size)
+                self.pending_messages[dest_header] = queue
+            elif len(queue) == queue.maxlen:
+                rospy.logwarn_throttle(10, "Unity send queue for %s is full, dropping the oldest messages", topic)
+            queue.append(message)
+            pending_condition.notify()
+
+    def sender_loop(self):
+        """
+        Waits for queued messages, then drains the queues and sends each message to Unity
+        on its own connection.
+        """
+        # This is the only thread sending to Unity, so errors are logged and never end the loop
+        while True:
+            try:
+                with self.pending_condition:
+                    while not any(self.pending_messages.values()):
+                        self.pending_condition.wait()
+                    batch = []
+                    for dest_header, queue in self.pending_messages.items():
+                        batch.extend((dest_header, message) for message in queue)
+                        queue.clear()
+
+                for dest_header, message in batch:
+                    try:
+                        self._send_to_unity(_serialize_message_cached(dest_header, message))
+                    except Exception as e:
+                        rospy.loginfo("Exception {}".format(e))
+            except Exception as e:
+                rospy.loginfo("Exception {}".format(e))
+
+    def _send_to_unity(self, serialized_message):
         try:
+            delay = self.next_connect_time - _clock()
+            if delay > 0:
+                time.sleep(delay)
+
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             s.settimeout(2)
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             s.connect((self.unity_ip, self.unity_port))
-            s.send(serialized_message)
+            _send_serialized_message(s, serialized_message)
             s.close()
+            self.reconnect_backoff = RECONNECT_BACKOFF_MIN
         except Exception as e:
             rospy.loginfo("Exception {}".format(e))
+            self.next_connect_time = _clock() + self.reconnect_backoff
+            self.reconnect_backoff = min(self.reconnect_backoff * 2, RECONNECT_BACKOFF_MAX)